@@ -5,19 +5,28 @@ Real-time stock market data with WebSocket support
 Flask + Flask-SocketIO implementation
 """
 
+# Patch the stdlib for cooperative greenlets before anything else imports it
+import eventlet
+eventlet.monkey_patch()
+
 import os
-import json
 import random
 import logging
+import threading
 from datetime import datetime, timedelta
-from collections import defaultdict
-from flask import Flask, render_template, jsonify
+from collections import defaultdict, deque
+from itertools import islice
+from pathlib import Path
+import numpy as np
+import orjson
+from numba import njit
+from flask import Flask, Response, render_template, request
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_cors import CORS
 
 # Configure logging
 logging.basicConfig(
-    level=logging.INFO,
+    level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
@@ -25,13 +34,91 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key')
 CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+
+HISTORY_LENGTH = 365
+DEFAULT_SYMBOLS = ('AAPL', 'GOOGL', 'MSFT')
+DEFAULTS_PATH = Path(__file__).with_name('defaults.json')
+SIMULATED_SYMBOLS = ('UBER', 'COIN', 'PLTR', 'SQ', 'SHOP', 'DIS', 'NKE', 'PYPL')
+
+
+class CentsBuffer(deque):
+    """Price history held as integer cents, serialized as dollars"""
+
+
+def _orjson_default(obj):
+    """Encode types orjson does not handle natively"""
+    if isinstance(obj, CentsBuffer):
+        return np.fromiter(obj, dtype=np.int64, count=len(obj)) / 100
+    if isinstance(obj, deque):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    """Serialize to JSON bytes with orjson"""
+    return orjson.dumps(obj, default=_orjson_default, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def trailing_dates(count):
+    """Return the last `count` calendar dates, oldest first, ending today"""
+    end_date = datetime.now().date()
+    return [end_date - timedelta(days=i) for i in range(count - 1, -1, -1)]
+
+
+def percent_change(delta_cents, base_cents):
+    """Percentage change rounded to two decimals, computed from integer cents"""
+    return round(delta_cents * 10000 / base_cents) / 100
+
+
+class OrjsonModule:
+    """Drop-in `json` module for Socket.IO packet encoding backed by orjson"""
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        return dumps(obj).decode()
+
+    @staticmethod
+    def loads(s, **kwargs):
+        return orjson.loads(s)
+
+
+def encoded(payload):
+    """Serialize a payload once so several packets can embed the same bytes"""
+    return orjson.Fragment(dumps(payload))
+
+
+class ORJSONResponse(Response):
+    """Flask response whose body is serialized with orjson"""
+    default_mimetype = 'application/json'
+
+    @classmethod
+    def of(cls, data, status=200):
+        return cls(dumps(data), status=status)
+
+
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet',
+                    json=OrjsonModule)
+
+
+@njit(cache=True, fastmath=True)
+def _walk(base, n, vol, seed):
+    """Compiled random walk returning n + 1 prices with +/- vol step volatility"""
+    out = np.empty(n + 1)
+    cur = base
+    np.random.seed(seed)
+    for i in range(n + 1):
+        cur *= 1.0 + (np.random.random() - 0.5) * 2 * vol
+        out[i] = cur
+    return out
 
 # In-memory storage
 class StockStore:
     def __init__(self):
         self.stocks = {}  # symbol -> stock data
-        self.clients = set()
+        self._symbol_list = []  # mirrors self.stocks keys for O(1) random picks
+        self._close_cents = {}  # symbol -> previous close in integer cents
+        self.client_count = 0
+        self._client_lock = threading.Lock()
         self.base_prices = {
             'AAPL': 175.50, 'GOOGL': 142.30, 'MSFT': 380.20,
             'AMZN': 155.80, 'TSLA': 245.60, 'META': 505.20,
@@ -45,30 +132,42 @@ class StockStore:
             '#bc13fe', '#ff0055', '#00ffff', '#ffff00'
         ]
         self.color_index = 0
+        self._rng = np.random.default_rng()
+        self._initial_data_json = None  # cached serialization, None when stale
+        self._values_cache = None  # cached tuple of self.stocks values
+    
+    def client_connected(self):
+        """Register a connection and return the new client count"""
+        with self._client_lock:
+            self.client_count += 1
+            return self.client_count
+    
+    def client_disconnected(self):
+        """Unregister a connection and return the new client count"""
+        with self._client_lock:
+            self.client_count = max(self.client_count - 1, 0)
+            return self.client_count
     
     def get_next_color(self):
         color = self.colors[self.color_index % len(self.colors)]
         self.color_index += 1
         return color
     
-    def generate_history(self, symbol, days=365):
+    def generate_history(self, symbol, days=HISTORY_LENGTH):
         """Generate realistic historical stock data using random walk"""
-        base = self.base_prices.get(symbol, 100 + random.random() * 200)
-        data = []
-        current = base
-        end_date = datetime.now()
-        
-        for i in range(days, -1, -1):
-            date = end_date - timedelta(days=i)
-            # Random walk with 1.5% volatility
-            change = (random.random() - 0.5) * 2 * 0.015
-            current = current * (1 + change)
-            data.append({
-                'x': date.strftime('%Y-%m-%d'),
-                'y': round(current, 2)
-            })
-        
-        return data
+        base = self.base_prices.get(symbol)
+        if base is None:
+            base = 100 + self._rng.random() * 200
+        dates = trailing_dates(days + 1)
+
+        # Random walk with 1.5% volatility, walked directly in cents
+        seed = int(self._rng.integers(2**32))
+        prices = np.rint(_walk(base * 100, days, 0.015, seed)).astype(np.int64).tolist()
+
+        return {
+            'x': deque(dates, maxlen=HISTORY_LENGTH),
+            'y': CentsBuffer(prices, maxlen=HISTORY_LENGTH)
+        }
     
     def add_stock(self, symbol):
         """Add a new stock to the store"""
@@ -78,25 +177,52 @@ class StockStore:
             return None, "Stock already exists"
         
         history = self.generate_history(symbol)
-        current = history[-1]['y']
-        previous = history[-2]['y']
-        change = round(current - previous, 2)
-        change_percent = round((change / previous) * 100, 2)
+        current_cents = history['y'][-1]
+        previous_cents = history['y'][-2]
+        change_cents = current_cents - previous_cents
+        current = current_cents / 100
         
         stock_data = {
             'symbol': symbol,
             'data': history,
             'current': current,
-            'change': change,
-            'changePercent': change_percent,
+            'previousClose': previous_cents / 100,
+            'change': change_cents / 100,
+            'changePercent': percent_change(change_cents, previous_cents),
             'color': self.get_next_color(),
-            'added_at': datetime.now().isoformat()
+            'added_at': datetime.now()
         }
         
         self.stocks[symbol] = stock_data
-        logger.info(f"Added stock: {symbol} at ${current}")
+        self._symbol_list.append(symbol)
+        self._close_cents[symbol] = previous_cents
+        self._initial_data_json = None
+        self._values_cache = None
+        logger.info("Added stock: %s at $%s", symbol, current)
         return stock_data, None
     
+    def load_stocks(self, stocks):
+        """Restore stock snapshots, rebuilding their daily dates to end today"""
+        for stock in stocks:
+            symbol = stock['symbol']
+            if symbol in self.stocks:
+                continue
+            
+            prices = np.rint(np.asarray(stock['data']['y']) * 100).astype(np.int64).tolist()
+            stock['data'] = {
+                'x': deque(trailing_dates(len(prices)), maxlen=HISTORY_LENGTH),
+                'y': CentsBuffer(prices, maxlen=HISTORY_LENGTH)
+            }
+            
+            stock['added_at'] = datetime.now()
+            self.stocks[symbol] = stock
+            self._symbol_list.append(symbol)
+            self._close_cents[symbol] = round(stock['previousClose'] * 100)
+            self.color_index += 1
+        
+        self._initial_data_json = None
+        self._values_cache = None
+    
     def remove_stock(self, symbol):
         """Remove a stock from the store"""
         symbol = symbol.upper().strip()
@@ -105,38 +231,78 @@ class StockStore:
             return False, "Stock not found"
         
         del self.stocks[symbol]
-        logger.info(f"Removed stock: {symbol}")
+        self._symbol_list.remove(symbol)
+        del self._close_cents[symbol]
+        self._initial_data_json = None
+        self._values_cache = None
+        logger.info("Removed stock: %s", symbol)
         return True, None
     
-    def update_price(self, symbol):
-        """Simulate a price update for a stock"""
-        if symbol not in self.stocks:
-            return None
-        
-        stock = self.stocks[symbol]
-        last_price = stock['data'][-1]['y']
-        change = (random.random() - 0.5) * 2
-        new_price = round(last_price + change, 2)
+    def _apply_price_change(self, symbol, stock, rand, timestamp):
+        """Move a stock's price by up to +/- $1 using a uniform draw in [0, 1)"""
+        history = stock['data']
+        last_cents = history['y'][-1]
+        change_cents = round((rand - 0.5) * 200)
+        new_cents = last_cents + change_cents
+        new_price = new_cents / 100
         
+        # Keep change/changePercent relative to the close captured in add_stock
+        close_cents = self._close_cents[symbol]
+        day_change_cents = new_cents - close_cents
         stock['current'] = new_price
-        stock['data'].append({
-            'x': datetime.now().isoformat(),
-            'y': new_price
-        })
+        stock['change'] = day_change_cents / 100
+        stock['changePercent'] = percent_change(day_change_cents, close_cents)
         
-        # Keep only last 365 days
-        if len(stock['data']) > 365:
-            stock['data'] = stock['data'][-365:]
+        # Bounded deques evict the oldest sample, keeping the last 365 days
+        history['x'].append(timestamp)
+        history['y'].append(new_cents)
         
         return {
             'symbol': symbol,
             'price': new_price,
-            'change': round(new_price - last_price, 2)
+            'change': change_cents / 100
         }
     
+    def update_price(self, symbol):
+        """Simulate a price update for a single stock"""
+        if symbol not in self.stocks:
+            return None
+        
+        update = self._apply_price_change(
+            symbol, self.stocks[symbol], self._rng.random(), datetime.now()
+        )
+        self._initial_data_json = None
+        return update
+    
+    def update_all_prices(self):
+        """Simulate one price tick for every tracked stock"""
+        if not self.stocks:
+            return []
+        
+        draws = self._rng.random(len(self.stocks)).tolist()
+        now = datetime.now()
+        updates = [
+            self._apply_price_change(symbol, stock, rand, now)
+            for (symbol, stock), rand in zip(self.stocks.items(), draws)
+        ]
+        self._initial_data_json = None
+        return updates
+    
     def get_all_stocks(self):
-        """Return all tracked stocks"""
-        return list(self.stocks.values())
+        """Return all tracked stocks as a tuple rebuilt only when stocks are added or removed"""
+        if self._values_cache is None:
+            self._values_cache = tuple(self.stocks.values())
+        return self._values_cache
+    
+    def get_initial_data_json(self):
+        """Return the initial_data payload as JSON bytes, re-serialized only after a change"""
+        if self._initial_data_json is None:
+            self._initial_data_json = dumps({'stocks': self.get_all_stocks()})
+        return self._initial_data_json
+    
+    def random_symbol(self):
+        """Pick a random tracked symbol without copying the key set"""
+        return random.choice(self._symbol_list)
     
     def get_stock(self, symbol):
         """Get specific stock data"""
@@ -156,7 +322,7 @@ def index():
 @app.route('/api/stocks')
 def get_stocks():
     """REST API: Get all stocks"""
-    return jsonify({
+    return ORJSONResponse.of({
         'success': True,
         'data': store.get_all_stocks(),
         'count': len(store.stocks)
@@ -168,33 +334,32 @@ def get_stock(symbol):
     """REST API: Get specific stock"""
     stock = store.get_stock(symbol)
     if not stock:
-        return jsonify({'success': False, 'error': 'Stock not found'}), 404
-    return jsonify({'success': True, 'data': stock})
+        return ORJSONResponse.of({'success': False, 'error': 'Stock not found'}, 404)
+    return ORJSONResponse.of({'success': True, 'data': stock})
 
 
 # WebSocket Events
 @socketio.on('connect')
 def handle_connect():
     """Handle client connection"""
-    store.clients.add(request.sid)
-    logger.info(f"Client connected: {request.sid} (Total: {len(store.clients)})")
+    count = store.client_connected()
+    logger.info("Client connected: %s (Total: %d)", request.sid, count)
     
-    # Send current stocks to new client
-    emit('initial_data', {
-        'stocks': store.get_all_stocks(),
-        'client_count': len(store.clients)
-    })
+    # Send current stocks to new client; the frame is shared until the store changes
+    emit('initial_data', orjson.Fragment(store.get_initial_data_json()))
+    
+    # Broadcast updated client count (the new client learns it from this frame)
+    socketio.emit('client_count', {'count': count})
     
-    # Broadcast updated client count
-    emit('client_count', {'count': len(store.clients)}, broadcast=True)
+    start_background_tasks()
 
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """Handle client disconnection"""
-    store.clients.discard(request.sid)
-    logger.info(f"Client disconnected: {request.sid} (Total: {len(store.clients)})")
-    emit('client_count', {'count': len(store.clients)}, broadcast=True)
+    count = store.client_disconnected()
+    logger.info("Client disconnected: %s (Total: %d)", request.sid, count)
+    socketio.emit('client_count', {'count': count})
 
 
 @socketio.on('add_stock')
@@ -213,7 +378,7 @@ def handle_add_stock(data):
         emit('error', {'message': error})
         return
     
-    # Broadcast to all clients including sender
+    # Broadcast to other clients and acknowledge the sender with the same bytes
     response = {
         'symbol': symbol,
         'stock': stock,
@@ -221,8 +386,10 @@ def handle_add_stock(data):
         'added_by': request.sid
     }
     
-    emit('stock_added', response, broadcast=True)
-    logger.info(f"Stock {symbol} added by {request.sid}")
+    payload = encoded(response)
+    socketio.emit('stock_added', payload, skip_sid=request.sid)
+    emit('stock_added_ack', payload)
+    logger.info("Stock %s added by %s", symbol, request.sid)
 
 
 @socketio.on('remove_stock')
@@ -243,23 +410,31 @@ def handle_remove_stock(data):
         'removed_by': request.sid
     }
     
-    emit('stock_removed', response, broadcast=True)
-    logger.info(f"Stock {symbol} removed by {request.sid}")
+    payload = encoded(response)
+    socketio.emit('stock_removed', payload, skip_sid=request.sid)
+    emit('stock_removed_ack', payload)
+    logger.info("Stock %s removed by %s", symbol, request.sid)
 
 
 @socketio.on('get_history')
 def handle_get_history(data):
     """Get historical data for a symbol"""
     symbol = data.get('symbol', '').upper().strip()
-    days = data.get('days', 365)
+    days = data.get('days', HISTORY_LENGTH)
     
     stock = store.get_stock(symbol)
     if not stock:
         emit('error', {'message': f'Stock {symbol} not found'})
         return
     
-    # Filter data by days
-    history = stock['data'][-days:] if days < len(stock['data']) else stock['data']
+    # Filter data by days, with the same start index as history[-days:]
+    history = stock['data']
+    start = len(history['y']) - days if days > 0 else -days
+    if start > 0:
+        history = {
+            'x': list(islice(history['x'], start, None)),
+            'y': CentsBuffer(islice(history['y'], start, None))
+        }
     
     emit('history_data', {
         'symbol': symbol,
@@ -270,33 +445,26 @@ def handle_get_history(data):
 # Background Tasks
 def price_update_task():
     """Background task to simulate price updates"""
-    import time
     while True:
         socketio.sleep(5)  # Update every 5 seconds
         
-        if store.stocks:
-            # Pick random stock to update
-            symbol = random.choice(list(store.stocks.keys()))
-            update = store.update_price(symbol)
-            
-            if update:
-                socketio.emit('price_update', update)
-                logger.debug(f"Price update: {symbol} = ${update['price']}")
+        # Tick every stock and send the batch as a single frame
+        updates = store.update_all_prices()
+        
+        if updates:
+            socketio.emit('price_updates', {'updates': updates})
+            logger.debug("Price updates: %d stocks", len(updates))
 
 
 def random_activity_task():
     """Simulate random user activity"""
-    import time
-    symbols = ['UBER', 'COIN', 'PLTR', 'SQ', 'SHOP', 'DIS', 'NKE', 'PYPL']
-    
     while True:
         socketio.sleep(20)  # Activity every 20 seconds
         
-        if random.random() > 0.5 and len(store.clients) > 0:
-            action = random.choice(['add', 'remove'])
-            
-            if action == 'add':
-                symbol = random.choice(symbols)
+        if random.getrandbits(1) and store.client_count > 0:
+            # Coin flip between simulating an add and a remove
+            if random.getrandbits(1):
+                symbol = random.choice(SIMULATED_SYMBOLS)
                 if symbol not in store.stocks:
                     stock, _ = store.add_stock(symbol)
                     if stock:
@@ -306,32 +474,48 @@ def random_activity_task():
                             'source': 'remote',
                             'message': f'{symbol} added by another user'
                         })
-                        logger.info(f"Simulated: Added {symbol}")
+                        logger.info("Simulated: Added %s", symbol)
             else:
                 if store.stocks:
-                    symbol = random.choice(list(store.stocks.keys()))
+                    symbol = store.random_symbol()
                     store.remove_stock(symbol)
                     socketio.emit('stock_removed', {
                         'symbol': symbol,
                         'source': 'remote',
                         'message': f'{symbol} removed by another user'
                     })
-                    logger.info(f"Simulated: Removed {symbol}")
+                    logger.info("Simulated: Removed %s", symbol)
 
 
 # Start background tasks
-@socketio.on('connect')
+_background_tasks_started = False
+
+
 def start_background_tasks():
     """Start background tasks on first connection"""
-    if len(store.clients) == 1:
+    global _background_tasks_started
+    if not _background_tasks_started:
+        _background_tasks_started = True
         socketio.start_background_task(price_update_task)
         socketio.start_background_task(random_activity_task)
 
 
+def load_default_stocks():
+    """Seed the store from the prebuilt defaults.json, or generate the defaults"""
+    if DEFAULTS_PATH.exists() and not os.environ.get('STOCKSYNC_REGEN'):
+        store.load_stocks(orjson.loads(DEFAULTS_PATH.read_bytes()).values())
+        logger.info("Loaded default stocks from %s", DEFAULTS_PATH.name)
+        # Compile the walk kernel now rather than on the first client add_stock
+        _walk(100.0, 1, 0.015, 0)
+        return
+    
+    for symbol in DEFAULT_SYMBOLS:
+        store.add_stock(symbol)
+
+
 if __name__ == '__main__':
     # Add some default stocks
-    for symbol in ['AAPL', 'GOOGL', 'MSFT']:
-        store.add_stock(symbol)
+    load_default_stocks()
     
     logger.info("Starting StockSync Server...")
     socketio.run(app, host='0.0.0.0', port=5000, debug=True)
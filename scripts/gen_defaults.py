@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Build step: pre-generate the default stock histories
+Writes defaults.json next to main.py so the server can load it at startup
+instead of running the random walk for every default symbol
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from main import DEFAULT_SYMBOLS, DEFAULTS_PATH, StockStore, dumps  # noqa: E402
+
+
+def main():
+    store = StockStore()
+    for symbol in DEFAULT_SYMBOLS:
+        store.add_stock(symbol)
+    
+    # Dates and added_at are rebuilt at load time, so only the prices are worth shipping
+    for stock in store.stocks.values():
+        del stock['data']['x']
+        del stock['added_at']
+    
+    DEFAULTS_PATH.write_bytes(dumps(store.stocks))
+    print(f"Wrote {len(store.stocks)} stocks to {DEFAULTS_PATH}")
+
+
+if __name__ == '__main__':
+    main()